@@ -1,21 +1,23 @@
-from flask import Flask, render_template, jsonify, request
-import json
+# en premier: démarre tracemalloc avant les imports lourds si AUTOFINDER_PROFILE=1
+import profiling
+from profiling import memory_checkpoint, profiled
+from flask import Flask, render_template, jsonify, request, abort
+import hmac
 import os
 import threading
 import time
+from typing import Any, Dict, Optional
 from llm_engine import generate_response, get_max_tokens, warmup as warmup_llm
-from intent_detector import detect_intent
-from rag_engine import search_voitures, warmup as warmup_rag
-from filters import extract_constraints, apply_filters
+from intent_detector import detect_intent, is_aggregate_query
+from rag_engine import get_catalog, search_filtered, warmup as warmup_rag
+from filters import extract_constraints, relax_filters, describe_relaxation
+from reply_cache import get_cached_reply, store_reply
+from stats_engine import get_stats, stats_for_constraints, format_stats, warmup as warmup_stats
 
 app = Flask(__name__)
 
-_BASE_DIR = os.path.dirname(__file__)
-_VOITURES_PATH = os.path.join(_BASE_DIR, "voitures.json")
-
-# Charger les voitures
-with open(_VOITURES_PATH, "r", encoding="utf-8") as f:
-    voitures = json.load(f)
+# Le catalogue est chargé une seule fois, par rag_engine (get_catalog)
+memory_checkpoint("imports")
 
 @app.route("/")
 def index():
@@ -23,51 +25,58 @@ def index():
 
 @app.route("/catalogue")
 def catalogue():
-    return render_template("catalogue.html", voitures=voitures)
+    return render_template("catalogue.html", voitures=get_catalog())
 
 @app.route("/chatbot")
 def chatbot():
     return render_template("chatbot.html")
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    start_ts = time.perf_counter()
-    data = request.get_json() or {}
-    history = data.get("history", [])
-    print(f"[chat] request received | history_len={len(history)}")
-    print(f"[chat] history={history}")
+@app.route("/api/stats")
+def api_stats():
+    annee = request.args.get("annee", type=int)
+    stats = get_stats(
+        marque=request.args.get("marque"),
+        carburant=request.args.get("carburant"),
+        transmission=request.args.get("transmission"),
+        annee=annee,
+    )
+    return jsonify(stats)
+
+def _last_user_message(hist):
+    for m in reversed(hist):
+        if m.get("role") == "user":
+            return m.get("content", "")
+    return ""
 
-    # ---- helpers locaux ----
-    def last_user_message(hist):
-        for m in reversed(hist):
-            if m.get("role") == "user":
+def _prev_user_message(hist):
+    seen_last = False
+    for m in reversed(hist):
+        if m.get("role") == "user":
+            if not seen_last:
+                seen_last = True
+            else:
                 return m.get("content", "")
-        return ""
-
-    def prev_user_message(hist):
-        seen_last = False
-        for m in reversed(hist):
-            if m.get("role") == "user":
-                if not seen_last:
-                    seen_last = True
-                else:
-                    return m.get("content", "")
-        return ""
-
-    def format_car(v: dict) -> str:
-        options = v.get("options", "")
-        if isinstance(options, list):
-            options = ", ".join(options)
-        return (
-            f"- ID: {v.get('id')} | {v.get('marque')} {v.get('modele')} | "
-            f"{v.get('carburant')} | {v.get('transmission')} | "
-            f"{v.get('kilometrage_km')} km | {v.get('prix')} DHS"
-            + (f" | Options: {options}" if options else "")
-        )
+    return ""
+
+def _format_car(v: dict) -> str:
+    options = v.get("options", "")
+    if isinstance(options, list):
+        options = ", ".join(options)
+    return (
+        f"- ID: {v.get('id')} | {v.get('marque')} {v.get('modele')} | "
+        f"{v.get('carburant')} | {v.get('transmission')} | "
+        f"{v.get('kilometrage_km')} km | {v.get('prix')} DHS"
+        + (f" | Options: {options}" if options else "")
+    )
 
+def resolve_intent(history: list) -> tuple:
+    """
+    Détermine l'intent du dernier message en tenant compte de l'historique.
+    Retourne (intent, last_user_msg, effective_history).
+    """
     # ---- intent ----
-    last_user_msg = last_user_message(history).strip()
-    prev_user_msg = prev_user_message(history).strip()
+    last_user_msg = _last_user_message(history).strip()
+    prev_user_msg = _prev_user_message(history).strip()
 
     intent = detect_intent(last_user_msg)
     prev_intent = detect_intent(prev_user_msg) if prev_user_msg else "smalltalk"
@@ -96,6 +105,33 @@ def chat():
     # garde-fou contexte (n_ctx=768)
     effective_history = effective_history[-12:]
 
+    # ---- question statistique ("prix moyen", "combien de voitures"): réponse par les agrégats, sans RAG ----
+    # (pas en cours de recherche: les relances portent sur les voitures déjà proposées)
+    if not already_car_search and is_aggregate_query(last_user_msg):
+        intent = "stats"
+
+    return intent, last_user_msg, effective_history
+
+def prepare_turn(
+    history: list,
+    filtered: Optional[list] = None,
+    resolved: Optional[tuple] = None,
+    constraints: Optional[Dict[str, Any]] = None,
+    k: int = 5,
+) -> Dict[str, Any]:
+    """
+    Construit le prompt LLM d'un tour de conversation (intent, filtres, RAG).
+    Le mode batch peut fournir ce qu'il a déjà calculé: `resolved` (retour de resolve_intent),
+    `constraints` (extract_constraints) et `filtered` (résultats de recherche).
+    `k` est le nombre de voitures retenues pour le prompt.
+    Retourne {"intent", "constraints", "cars", "last_user_msg", "effective_history", "prompt"}.
+    """
+    intent, last_user_msg, effective_history = resolved or resolve_intent(history)
+
+    if constraints is None:
+        constraints = extract_constraints(last_user_msg) if intent in ("car_search", "stats") else {}
+    cars: list = []
+
     # ---- prompts (achat voiture + push vers recherche) ----
     if intent == "smalltalk":
         system_prompt = (
@@ -106,33 +142,35 @@ def chat():
         rag_context = ""
 
     elif intent == "car_search":
-        # ---- extraire contraintes utilisateur ----
-        constraints = extract_constraints(last_user_msg)
         print(f"[filters] constraints={constraints}")
 
         system_prompt = (
             "Tu es un assistant expert pour aider l'utilisateur à trouver une voiture à acheter. "
             "Tu reçois: (1) des FILTRES extraits du message utilisateur, (2) un CATALOGUE filtré. "
             "Règles strictes: "
-            "1) Ne propose QUE des voitures présentes dans le CATALOGUE FILTRÉ. "
-            "2) Ne contredis pas les FILTRES. "
+            "1) Ne propose QUE des voitures présentes dans le CATALOGUE FILTRÉ, "
+            "   ou dans le CATALOGUE ÉLARGI uniquement si le CATALOGUE FILTRÉ est vide. "
+            "2) Ne contredis pas les FILTRES. Seules les voitures du CATALOGUE ÉLARGI peuvent s'en écarter, "
+            "   et uniquement sur les critères indiqués comme relâchés. "
             "3) Si le CATALOGUE FILTRÉ n'est pas vide, commence toujours par lister TOUTES les voitures "
             "   (ne saute aucun ID), même si des filtres sont manquants. "
             "   Mets UNE voiture par ligne. "
             "4) Après la liste, dis que des critères plus précis donnent des résultats plus précis, "
             "   puis pose AU PLUS UNE question de précision. "
             "4) Si le CATALOGUE FILTRÉ est vide, explique clairement qu'aucune voiture ne correspond. "
-            "   Propose de 'rafraîchir la conversation' (repartir de zéro) ET demande UN ajustement concret "
+            "   Si un CATALOGUE ÉLARGI est fourni, présente ces voitures en précisant pour chacune "
+            "   le critère relâché (ex: budget dépassé de 10%). "
+            "   Sinon propose de 'rafraîchir la conversation' (repartir de zéro) ET demande UN ajustement concret "
             "   (ex: augmenter budget, changer carburant, augmenter km, élargir marque). "
             "5) Quand tu proposes une voiture, mentionne toujours son ID. "
             "6) N'invente aucune voiture ni caractéristique."
         )
 
         # ---- filtrage puis RAG ----
-        candidates = search_voitures(last_user_msg, k=5, constraints=constraints)
-        candidates_lines = "\n".join(format_car(v) for v in candidates)
-        print(f"[rag] candidates (top {len(candidates)}):\n{candidates_lines}")
-        filtered = apply_filters(candidates, constraints)
+        if filtered is None:
+            filtered = search_filtered(last_user_msg, k=k, constraints=constraints)
+        candidates_lines = "\n".join(_format_car(v) for v in filtered)
+        print(f"[rag] candidates (top {len(filtered)}):\n{candidates_lines}")
 
         # ---- contexte filtres ----
         filters_text = (
@@ -148,8 +186,9 @@ def chat():
 
         # ---- IMPORTANT: le LLM ne voit QUE le catalogue filtré ----
         if filtered:
-            cars_for_prompt = filtered[:5]
-            rag_lines = "\n".join(format_car(v) for v in cars_for_prompt)
+            cars_for_prompt = filtered[:k]
+            cars = cars_for_prompt
+            rag_lines = "\n".join(_format_car(v) for v in cars_for_prompt)
             rag_context = (
                 filters_text
                 + "\nCATALOGUE FILTRÉ:\n"
@@ -157,11 +196,46 @@ def chat():
                 + "\n"
             )
         else:
+            # ---- aucun résultat: relaxation minimale sur tout le catalogue ----
+            relaxed_results = relax_filters(get_catalog(), constraints, limit=k)
+            print(f"[filters] relaxed results={len(relaxed_results)}")
+            cars = [r["voiture"] for r in relaxed_results]
             rag_context = (
                 filters_text
                 + "\nCATALOGUE FILTRÉ:\n"
                 "- (Aucun résultat)\n"
             )
+            if relaxed_results:
+                relaxed_lines = "\n".join(
+                    _format_car(r["voiture"])
+                    + f" | Relâché: {describe_relaxation(constraints, r['relaxed'])}"
+                    for r in relaxed_results
+                )
+                rag_context += "\nCATALOGUE ÉLARGI (critères relâchés):\n" + relaxed_lines + "\n"
+
+        # ---- question statistique en cours de recherche: agrégats en plus du catalogue ----
+        if is_aggregate_query(last_user_msg):
+            stats = stats_for_constraints(constraints)
+            print(f"[stats] filtres={stats['filtres']} count={stats['count']}")
+            rag_context += "\nSTATISTIQUES CATALOGUE (chiffres exacts, à citer tels quels):\n" + format_stats(stats) + "\n"
+
+    elif intent == "stats":
+        # ---- agrégats exacts du catalogue: lookup, pas de recherche vectorielle ----
+        print(f"[filters] constraints={constraints}")
+        stats = stats_for_constraints(constraints)
+        print(f"[stats] filtres={stats['filtres']} count={stats['count']}")
+
+        system_prompt = (
+            "Tu es un assistant expert pour aider l'utilisateur à trouver une voiture à acheter. "
+            "Tu reçois des STATISTIQUES CATALOGUE exactes, calculées sur le périmètre indiqué. "
+            "Règles strictes: "
+            "1) Réponds à la question (nombre, moyenne, médiane, min, max) avec ces chiffres, "
+            "   sans les recalculer ni les arrondir autrement. "
+            "2) Précise toujours le périmètre sur lequel portent les chiffres. "
+            "3) N'invente aucune voiture ni aucun chiffre. "
+            "4) Termine en proposant de chercher des voitures correspondantes."
+        )
+        rag_context = "STATISTIQUES CATALOGUE:\n" + format_stats(stats) + "\n"
 
     else:
         system_prompt = (
@@ -185,20 +259,77 @@ def chat():
             prompt += f"Assistant: {content}\n"
     prompt += "Assistant:"
 
+    return {
+        "intent": intent,
+        "constraints": constraints,
+        "cars": cars,
+        "last_user_msg": last_user_msg,
+        "effective_history": effective_history,
+        "prompt": prompt,
+    }
+
+@app.route("/admin/profile")
+def admin_profile():
+    if not profiling.ENABLED:
+        abort(404)
+    # token obligatoire: sans AUTOFINDER_PROFILE_TOKEN, l'endpoint reste fermé.
+    # Passé en en-tête (pas dans l'URL, qui finit dans les logs d'accès), comparé en temps constant.
+    token = profiling.profile_token()
+    provided = request.headers.get("X-Profile-Token", "")
+    if not token or not hmac.compare_digest(provided.encode("utf-8"), token.encode("utf-8")):
+        abort(403)
+    return jsonify(profiling.report(
+        top=request.args.get("top", profiling.TOP_N, type=int),
+        reset=request.args.get("reset") == "1",
+    ))
+
+@app.route("/chat", methods=["POST"])
+@profiled("chat")
+def chat():
+    start_ts = time.perf_counter()
+    data = request.get_json() or {}
+    history = data.get("history", [])
+    print(f"[chat] request received | history_len={len(history)}")
+    print(f"[chat] history={history}")
+
+    turn = prepare_turn(history)
+    prompt = turn["prompt"]
+
+    # ---- cache: uniquement pour les tours sans historique (messages d'ouverture) ----
+    cacheable = len(turn["effective_history"]) == 1
+    if cacheable:
+        cache_args = (
+            turn["intent"],
+            turn["constraints"],
+            [v.get("id") for v in turn["cars"]],
+            turn["last_user_msg"],
+        )
+        cached_reply = get_cached_reply(*cache_args)
+        if cached_reply is not None:
+            total_ms = (time.perf_counter() - start_ts) * 1000
+            print(f"[chat] cached reply | total_ms={total_ms:.1f}")
+            return jsonify({"reply": cached_reply})
+
     print(f"[chat] calling LLM | max_tokens={get_max_tokens()}")
     llm_start = time.perf_counter()
     llm_reply = generate_response(prompt)
     llm_ms = (time.perf_counter() - llm_start) * 1000
+    if cacheable and llm_reply:
+        store_reply(*cache_args, llm_reply)
     total_ms = (time.perf_counter() - start_ts) * 1000
     print(f"[chat] LLM done | llm_ms={llm_ms:.1f} total_ms={total_ms:.1f}")
     return jsonify({"reply": llm_reply})
 
+@profiled("warmup")
 def _warmup_heavy() -> None:
     print("[warmup] starting heavy loads in background...")
     t0 = time.perf_counter()
     try:
         warmup_rag()
+        warmup_stats()
+        memory_checkpoint("stats")
         warmup_llm()
+        memory_checkpoint("llm")
     finally:
         ms = (time.perf_counter() - t0) * 1000
         print(f"[warmup] done | ms={ms:.1f}")
@@ -0,0 +1,156 @@
+import argparse
+import json
+import sys
+import time
+from app import prepare_turn, resolve_intent
+from filters import extract_constraints
+from llm_engine import generate_response, warmup as warmup_llm
+from rag_engine import search_filtered_batch, warmup as warmup_rag
+
+"""
+Mode batch hors ligne.
+
+Répond à un fichier de requêtes JSONL dans un seul process, sans passer par /chat:
+intents et contraintes calculés en masse, embeddings encodés par lots,
+recherche Chroma groupée par jeu de contraintes, puis (optionnellement) le LLM.
+
+Entrée (une ligne JSON par requête):
+  {"id": "q1", "query": "je cherche une toyota diesel"}
+  {"id": "q2", "history": [{"role": "user", "content": "..."}, ...]}
+
+Sortie (une ligne JSON par requête, écrite au fil de l'eau):
+  {"id", "intent", "constraints", "car_ids", "reply"?}
+  ou {"id", "error"} si la requête n'a pas pu être traitée
+
+Exemple:
+  python batch.py requetes.jsonl reponses.jsonl --llm
+"""
+
+
+def _read_records(path: str):
+    """
+    Produit (line_no, record, erreur) pour chaque ligne non vide du fichier.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line), None
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"JSON invalide: {e}"
+
+
+def _chunks(records, size: int):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _history_of(record) -> list:
+    if not isinstance(record, dict):
+        raise ValueError("la ligne doit être un objet JSON")
+    history = record.get("history")
+    if history is None:
+        history = [{"role": "user", "content": str(record.get("query", ""))}]
+    if not isinstance(history, list) or not all(isinstance(m, dict) for m in history):
+        raise ValueError("history doit être une liste de messages {role, content}")
+    return history
+
+
+def _write_row(out, row: dict) -> None:
+    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+def _process_chunk(chunk: list, out, k: int, batch_size: int, with_llm: bool) -> None:
+    # ---- intents + contraintes en masse ----
+    prepared: dict = {}   # index dans le chunk -> (history, resolved, constraints)
+    errors: dict = {}     # index dans le chunk -> message d'erreur
+    for idx, (line_no, record, error) in enumerate(chunk):
+        if error is not None:
+            errors[idx] = error
+            continue
+        try:
+            history = _history_of(record)
+            resolved = resolve_intent(history)
+            intent, last_user_msg, _ = resolved
+            constraints = extract_constraints(last_user_msg) if intent in ("car_search", "stats") else {}
+            prepared[idx] = (history, resolved, constraints)
+        except Exception as e:
+            errors[idx] = f"{type(e).__name__}: {e}"
+
+    # ---- embeddings + recherche groupés (car_search uniquement) ----
+    search_idx = [idx for idx, (_, resolved, _) in prepared.items() if resolved[0] == "car_search"]
+    results = search_filtered_batch(
+        [prepared[idx][1][1] for idx in search_idx],
+        [prepared[idx][2] for idx in search_idx],
+        k=k,
+        batch_size=batch_size,
+    )
+    filtered_by_idx = dict(zip(search_idx, results))
+
+    for idx, (line_no, record, _) in enumerate(chunk):
+        record_id = record.get("id", line_no) if isinstance(record, dict) else line_no
+        if idx in errors:
+            print(f"[batch] ligne {line_no} en erreur: {errors[idx]}", file=sys.stderr)
+            _write_row(out, {"id": record_id, "error": errors[idx]})
+            continue
+
+        history, resolved, constraints = prepared[idx]
+        try:
+            turn = prepare_turn(
+                history,
+                filtered=filtered_by_idx.get(idx),
+                resolved=resolved,
+                constraints=constraints,
+                k=k,
+            )
+            row = {
+                "id": record_id,
+                "intent": turn["intent"],
+                "constraints": turn["constraints"],
+                "car_ids": [v.get("id") for v in turn["cars"]],
+            }
+            if with_llm:
+                row["reply"] = generate_response(turn["prompt"])
+        except Exception as e:
+            print(f"[batch] ligne {line_no} en erreur: {type(e).__name__}: {e}", file=sys.stderr)
+            row = {"id": record_id, "error": f"{type(e).__name__}: {e}"}
+        _write_row(out, row)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="AutoFinder - réponses en batch depuis un fichier JSONL")
+    parser.add_argument("input", help="fichier JSONL de requêtes")
+    parser.add_argument("output", help="fichier JSONL de sortie")
+    parser.add_argument("-k", type=int, default=5, help="nombre de voitures par requête")
+    parser.add_argument("--batch-size", type=int, default=64, help="taille des lots d'embeddings")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="requêtes traitées par passe")
+    parser.add_argument("--llm", action="store_true", help="générer aussi la réponse du LLM")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    warmup_rag()
+    if args.llm:
+        warmup_llm()
+
+    count = 0
+    with open(args.output, "w", encoding="utf-8") as out:
+        for chunk in _chunks(_read_records(args.input), args.chunk_size):
+            _process_chunk(chunk, out, args.k, args.batch_size, args.llm)
+            count += len(chunk)
+            print(f"[batch] {count} requêtes traitées")
+
+    ms = (time.perf_counter() - t0) * 1000
+    print(f"[batch] done | count={count} ms={ms:.1f}")
+
+
+if __name__ == "__main__":
+    main()
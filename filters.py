@@ -1,3 +1,5 @@
+import heapq
+import math
 import re
 from typing import Any, Dict, Optional
 
@@ -113,7 +115,8 @@ def extract_constraints(text: str) -> Dict[str, Any]:
             c["prix_max"] = max(val_min, val_max)
 
     # prix max: "moins de 80000", "< 80000", "max 80000", "budget 80000", "80000 dh"
-    m = re.search(r"(moins de|<=|<|max|budget)\s*(\d[\d\s]{2,})", t)
+    # (un nombre suivi de "km" est un kilométrage, pas un prix)
+    m = re.search(r"(moins de|<=|<|max|budget)\s*(\d[\d\s]{2,}?)(?!\s*\d)(?!\s*(?:km|kms)\b)", t)
     if m:
         val = _to_int(m.group(2))
         if val is not None:
@@ -202,3 +205,103 @@ def apply_filters(cars: list, constraints: Dict[str, Any]) -> list:
 
         out.append(v)
     return out
+
+
+# ----------------------------
+# Relaxation des contraintes
+# ----------------------------
+
+# Unité de coût: 1 = changer de boîte. Une marque citée par l'utilisateur est le critère
+# le plus fort (≈ 75% de budget en plus), le carburant vient ensuite (≈ 37% de budget).
+# Le kilométrage est compté en log: doubler km_max coûte 0.5, le multiplier par 8 coûte 1.5,
+# pour qu'une borne km très basse ne fasse pas abandonner marque et carburant.
+RELAX_DROP_COST = {
+    "transmission": 1.0,
+    "carburant": 3.0,
+    "marque": 6.0,
+}
+# Par tranche de 100% au-dessus de prix_max / en dessous de prix_min
+RELAX_PRICE_OVER_COST = 8.0
+RELAX_PRICE_UNDER_COST = 2.0
+# Par doublement de km_max
+RELAX_KM_DOUBLING_COST = 0.5
+# Par année d'écart sur annee_min / annee_max
+RELAX_YEAR_COST = 0.5
+
+
+def _relaxation_for(v: dict, constraints: Dict[str, Any]) -> tuple:
+    """
+    Calcule la relaxation minimale qui ferait passer la voiture `v`.
+    Retourne (cout, relaxed).
+    `relaxed` associe chaque contrainte à sa nouvelle valeur (None = critère abandonné).
+    """
+    cost = 0.0
+    relaxed: Dict[str, Any] = {}
+
+    for key in ("carburant", "transmission", "marque"):
+        if key in constraints and str(v.get(key, "")).lower() != str(constraints[key]).lower():
+            cost += RELAX_DROP_COST[key]
+            relaxed[key] = None
+
+    prix = v.get("prix")
+    km = v.get("kilometrage_km")
+    annee = v.get("annee")
+
+    if "prix_max" in constraints and isinstance(prix, (int, float)) and prix > constraints["prix_max"]:
+        cost += RELAX_PRICE_OVER_COST * (prix - constraints["prix_max"]) / max(constraints["prix_max"], 1)
+        relaxed["prix_max"] = prix
+    if "prix_min" in constraints and isinstance(prix, (int, float)) and prix < constraints["prix_min"]:
+        cost += RELAX_PRICE_UNDER_COST * (constraints["prix_min"] - prix) / max(constraints["prix_min"], 1)
+        relaxed["prix_min"] = prix
+    if "km_max" in constraints and isinstance(km, (int, float)) and km > constraints["km_max"]:
+        cost += RELAX_KM_DOUBLING_COST * math.log2(km / max(constraints["km_max"], 1))
+        relaxed["km_max"] = km
+    if "annee_min" in constraints and isinstance(annee, int) and annee < constraints["annee_min"]:
+        cost += (constraints["annee_min"] - annee) * RELAX_YEAR_COST
+        relaxed["annee_min"] = annee
+    if "annee_max" in constraints and isinstance(annee, int) and annee > constraints["annee_max"]:
+        cost += (annee - constraints["annee_max"]) * RELAX_YEAR_COST
+        relaxed["annee_max"] = annee
+
+    return cost, relaxed
+
+
+def relax_filters(cars: list, constraints: Dict[str, Any], limit: int = 5) -> list:
+    """
+    Quand apply_filters ne retourne rien, cherche en une seule passe sur le catalogue
+    les voitures qui demandent la plus petite relaxation des contraintes.
+
+    Retourne une liste de dicts {"voiture", "relaxed", "cout"} triée par coût croissant.
+    `relaxed` indique pour chaque contrainte relâchée la valeur nécessaire
+    (ex: {"prix_max": 92000}) ou None si le critère est abandonné (ex: {"marque": None}).
+    """
+    if not constraints:
+        return []
+
+    def scored():
+        for v in cars:
+            cost, relaxed = _relaxation_for(v, constraints)
+            yield cost, len(relaxed), v, relaxed
+
+    best = heapq.nsmallest(limit, scored(), key=lambda s: (s[0], s[1]))
+    return [
+        {"voiture": v, "relaxed": relaxed, "cout": round(cost, 3)}
+        for cost, _, v, relaxed in best
+    ]
+
+
+def describe_relaxation(constraints: Dict[str, Any], relaxed: Dict[str, Any]) -> str:
+    """
+    Résumé lisible d'une relaxation, ex: "prix_max 80000 -> 92000 (+15%), marque: critère abandonné (BMW)".
+    """
+    parts = []
+    for key, new_value in relaxed.items():
+        old_value = constraints.get(key)
+        if new_value is None:
+            parts.append(f"{key}: critère abandonné ({old_value})")
+        elif isinstance(old_value, (int, float)) and key in ("prix_max", "prix_min", "km_max") and old_value:
+            pct = (new_value - old_value) * 100 / old_value
+            parts.append(f"{key} {old_value} -> {new_value} ({pct:+.0f}%)")
+        else:
+            parts.append(f"{key} {old_value} -> {new_value}")
+    return ", ".join(parts) if parts else "aucune"
@@ -1,5 +1,6 @@
 import re
 from typing import Literal
+from filters import BRAND_MAP
 
 Intent = Literal["car_search", "smalltalk", "other"]
 
@@ -20,6 +21,26 @@ _CAR_KEYWORDS = [
     "marque", "modèle", "modele"
 ]
 
+# Questions statistiques sur le catalogue: un mot d'agrégat avec un sujet au niveau du catalogue
+# ("prix moyen", "km médian", "combien de voitures/Toyota", "nombre d'Audi", "statistiques").
+_CATALOG_SUBJECTS = r"(?:voitures?|v[ée]hicules?|annonces?|" + "|".join(
+    re.escape(b) for b in sorted(BRAND_MAP, key=len, reverse=True)
+) + r")"
+_AGGREGATE_PATTERNS = [
+    re.compile(r"\b(?:prix|km|kilom[ée]trages?)\s+(?:moyens?|moyennes?|m[ée]dians?|m[ée]dianes?)\b"),
+    re.compile(r"\b(?:moyenne|m[ée]diane)\s+des?\s+(?:prix|km|kilom[ée]trages?)\b"),
+    re.compile(r"\b(?:combien|nombre)\s+(?:de\s+|d')" + _CATALOG_SUBJECTS + r"\b"),
+    re.compile(r"\bstatistiques?\b"),
+]
+# Question sur une voiture précise ("la voiture ID 12"): jamais une question statistique
+_CAR_ID_PATTERN = re.compile(r"\bid\s*[:#]?\s*\d+")
+
+def is_aggregate_query(text: str) -> bool:
+    t = (text or "").strip().lower()
+    if _CAR_ID_PATTERN.search(t):
+        return False
+    return any(p.search(t) for p in _AGGREGATE_PATTERNS)
+
 def detect_intent(text: str) -> Intent:
     t = (text or "").strip().lower()
     if not t:
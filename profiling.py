@@ -0,0 +1,209 @@
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# ----------------------------
+# Profilage optionnel (AUTOFINDER_PROFILE=1)
+# ----------------------------
+
+ENABLED = os.getenv("AUTOFINDER_PROFILE", "0") == "1"
+# Intervalle d'échantillonnage CPU (secondes)
+SAMPLE_INTERVAL = float(os.getenv("AUTOFINDER_PROFILE_INTERVAL", "0.005"))
+# Nombre de frames conservées par trace mémoire
+TRACEMALLOC_FRAMES = int(os.getenv("AUTOFINDER_PROFILE_FRAMES", "1"))
+TOP_N = 20
+
+_lock = threading.Lock()
+_active: Dict[int, str] = {}          # thread id -> section profilée
+_self_samples: Dict[str, Counter] = {}
+_cumulative_samples: Dict[str, Counter] = {}
+_sample_counts: Counter = Counter()
+_sampler = None
+
+_checkpoints: list = []
+_last_snapshot = None
+_last_rss = 0
+
+if ENABLED:
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    print(f"[profile] enabled | interval={SAMPLE_INTERVAL}s tracemalloc_frames={TRACEMALLOC_FRAMES}")
+    if not os.getenv("AUTOFINDER_PROFILE_TOKEN"):
+        print("[profile] AUTOFINDER_PROFILE_TOKEN non défini: /admin/profile répondra 403")
+
+def rss_bytes() -> int:
+    """
+    Mémoire résidente actuelle du process (inclut les allocations natives: llama.cpp, torch...).
+    Lue dans /proc (Linux); retourne 0 ailleurs plutôt qu'un pic (ru_maxrss) qui fausserait les deltas.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def _mb(n: int) -> float:
+    return round(n / (1024 * 1024), 2)
+
+# ----------------------------
+# CPU: échantillonnage des piles
+# ----------------------------
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+def _sampler_loop() -> None:
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        frames = sys._current_frames()
+        with _lock:
+            for tid, label in _active.items():
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                _sample_counts[label] += 1
+                _self_samples.setdefault(label, Counter())[_frame_key(frame)] += 1
+                cumulative = _cumulative_samples.setdefault(label, Counter())
+                seen = set()
+                while frame is not None:
+                    key = _frame_key(frame)
+                    if key not in seen:
+                        cumulative[key] += 1
+                        seen.add(key)
+                    frame = frame.f_back
+
+def _ensure_sampler() -> None:
+    global _sampler
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sampler_loop, name="profile-sampler", daemon=True)
+            _sampler.start()
+
+@contextmanager
+def profile_section(label: str):
+    """
+    Échantillonne la pile du thread courant tant que la section est active.
+    Ne fait rien si le profilage est désactivé.
+    """
+    if not ENABLED:
+        yield
+        return
+    _ensure_sampler()
+    tid = threading.get_ident()
+    with _lock:
+        previous = _active.get(tid)
+        _active[tid] = label
+    try:
+        yield
+    finally:
+        with _lock:
+            if previous is None:
+                _active.pop(tid, None)
+            else:
+                _active[tid] = previous
+
+def profiled(label: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile_section(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# ----------------------------
+# Mémoire: checkpoints tracemalloc par sous-système
+# ----------------------------
+
+def _top_stats(stats, limit: int) -> list:
+    return [
+        {
+            "where": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+            "size_mb": _mb(s.size_diff if hasattr(s, "size_diff") else s.size),
+            "count": s.count_diff if hasattr(s, "count_diff") else s.count,
+        }
+        for s in stats[:limit]
+    ]
+
+def memory_checkpoint(name: str) -> None:
+    """
+    Enregistre la mémoire allouée depuis le checkpoint précédent (tracemalloc + RSS),
+    attribuée au sous-système `name`. Ne fait rien si le profilage est désactivé.
+    """
+    global _last_snapshot, _last_rss
+    if not ENABLED:
+        return
+    t0 = time.perf_counter()
+    snapshot = tracemalloc.take_snapshot()
+    rss = rss_bytes()
+    if _last_snapshot is None:
+        stats = snapshot.statistics("lineno")
+        python_bytes = sum(s.size for s in stats)
+    else:
+        stats = snapshot.compare_to(_last_snapshot, "lineno")
+        python_bytes = sum(s.size_diff for s in stats)
+
+    checkpoint = {
+        "name": name,
+        "python_mb": _mb(python_bytes),
+        "rss_delta_mb": _mb(rss - _last_rss),
+        "rss_mb": _mb(rss),
+        "top": _top_stats(stats, 10),
+    }
+    with _lock:
+        _checkpoints.append(checkpoint)
+    _last_snapshot = snapshot
+    _last_rss = rss
+    ms = (time.perf_counter() - t0) * 1000
+    print(
+        f"[profile] memory {name} | python_mb={checkpoint['python_mb']} "
+        f"rss_delta_mb={checkpoint['rss_delta_mb']} rss_mb={checkpoint['rss_mb']} ms={ms:.1f}"
+    )
+
+# ----------------------------
+# Rapport
+# ----------------------------
+
+def report(top: int = TOP_N, reset: bool = False) -> Dict[str, Any]:
+    if not ENABLED:
+        return {"enabled": False}
+
+    current = tracemalloc.take_snapshot().statistics("lineno")
+    traced, peak = tracemalloc.get_traced_memory()
+    with _lock:
+        cpu = {
+            label: {
+                "samples": _sample_counts[label],
+                "interval_s": SAMPLE_INTERVAL,
+                "self": _self_samples.get(label, Counter()).most_common(top),
+                "cumulative": _cumulative_samples.get(label, Counter()).most_common(top),
+            }
+            for label in _sample_counts
+        }
+        checkpoints = list(_checkpoints)
+        if reset:
+            _sample_counts.clear()
+            _self_samples.clear()
+            _cumulative_samples.clear()
+
+    return {
+        "enabled": True,
+        "rss_mb": _mb(rss_bytes()),
+        "python_traced_mb": _mb(traced),
+        "python_peak_mb": _mb(peak),
+        "memory_checkpoints": checkpoints,
+        "top_allocators": _top_stats(current, top),
+        "cpu": cpu,
+    }
+
+def profile_token() -> Optional[str]:
+    return os.getenv("AUTOFINDER_PROFILE_TOKEN") or None
@@ -1,11 +1,14 @@
 import json
+import math
 import os
 import shutil
 import time
+from collections import Counter
 from typing import Any, Dict, Optional
 from sentence_transformers import SentenceTransformer
 import chromadb
 from chromadb.config import Settings
+from profiling import memory_checkpoint
 
 # ----------------------------
 # Chargement des données
@@ -18,6 +21,49 @@ _SIGNATURE_PATH = os.path.join(_CHROMA_DIR, "voitures.sig")
 
 _embedding_model = None
 _collection = None
+_voitures = None
+_voitures_sig = None
+_facets = None
+
+# Taille des tranches d'années pour les facettes (ex: 2015-2019)
+YEAR_BUCKET_SIZE = 5
+
+# Facettes catégorielles: filtrées côté Chroma avec l'orthographe exacte du catalogue
+_CATEGORICAL_FACETS = ("marque", "carburant", "transmission")
+
+def _catalog_signature() -> str:
+    # Signature simple: mtime + taille (suffisant ici)
+    try:
+        stat = os.stat(_VOITURES_PATH)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"voitures.json introuvable: {_VOITURES_PATH}")
+    return f"{int(stat.st_mtime)}:{stat.st_size}"
+
+def get_catalog_signature() -> str:
+    return _catalog_signature()
+
+def get_catalog() -> list:
+    """
+    Catalogue voitures.json partagé par tout le process (une seule copie en mémoire).
+    """
+    return _load_voitures()
+
+def _load_voitures() -> list:
+    """
+    Charge voitures.json (rechargé si le fichier change).
+    """
+    global _voitures, _voitures_sig, _facets
+    current_sig = _catalog_signature()
+    if _voitures is None or _voitures_sig != current_sig:
+        print("[rag] loading voitures.json...")
+        t0 = time.perf_counter()
+        with open(_VOITURES_PATH, "r", encoding="utf-8") as f:
+            _voitures = json.load(f)
+        _voitures_sig = current_sig
+        _facets = None
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"[rag] voitures.json loaded | ms={ms:.1f} count={len(_voitures)}")
+    return _voitures
 
 def _get_embedding_model() -> SentenceTransformer:
     global _embedding_model
@@ -34,12 +80,7 @@ def _get_collection():
     if _collection is not None:
         return _collection
 
-    # Signature simple: mtime + taille (suffisant ici)
-    try:
-        stat = os.stat(_VOITURES_PATH)
-        current_sig = f"{int(stat.st_mtime)}:{stat.st_size}"
-    except FileNotFoundError:
-        raise FileNotFoundError(f"voitures.json introuvable: {_VOITURES_PATH}")
+    current_sig = _catalog_signature()
 
     previous_sig = None
     if os.path.isfile(_SIGNATURE_PATH):
@@ -66,12 +107,7 @@ def _get_collection():
         print("[rag] collection missing, creating + adding documents...")
         collection = client.create_collection("voitures")
 
-        print("[rag] loading voitures.json...")
-        t1 = time.perf_counter()
-        with open(_VOITURES_PATH, "r", encoding="utf-8") as f:
-            voitures = json.load(f)
-        ms = (time.perf_counter() - t1) * 1000
-        print(f"[rag] voitures.json loaded | ms={ms:.1f} count={len(voitures)}")
+        voitures = _load_voitures()
 
         embedding_model = _get_embedding_model()
 
@@ -116,7 +152,81 @@ def _get_collection():
     return _collection
 
 def warmup() -> None:
+    _load_voitures()
+    memory_checkpoint("voitures")
+    _get_embedding_model()
+    memory_checkpoint("embedding_model")
     _get_collection()
+    memory_checkpoint("chroma")
+    get_facet_counts()
+    memory_checkpoint("facets")
+
+def embed_texts(texts: list):
+    """
+    Embeddings normalisés (norme 1): le produit scalaire donne la similarité cosinus.
+    """
+    return _get_embedding_model().encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+
+# ----------------------------
+# Facettes (sélectivité des filtres)
+# ----------------------------
+
+def year_bucket(annee: int) -> str:
+    start = (annee // YEAR_BUCKET_SIZE) * YEAR_BUCKET_SIZE
+    return f"{start}-{start + YEAR_BUCKET_SIZE - 1}"
+
+def get_facet_counts() -> Dict[str, Any]:
+    """
+    Comptes par facette (marque, carburant, transmission, tranche d'années),
+    précalculés une fois par version du catalogue. "valeurs" associe chaque valeur
+    catégorielle en minuscules à son (ou ses) orthographe(s) dans le catalogue.
+    """
+    global _facets
+    voitures = _load_voitures()
+    if _facets is None:
+        t0 = time.perf_counter()
+        facets: Dict[str, Any] = {"total": len(voitures), "valeurs": {}}
+        for key in _CATEGORICAL_FACETS:
+            facets[key] = Counter(str(v.get(key, "")).lower() for v in voitures)
+            spellings: Dict[str, set] = {}
+            for v in voitures:
+                value = str(v.get(key, ""))
+                spellings.setdefault(value.lower(), set()).add(value)
+            facets["valeurs"][key] = {low: sorted(vals) for low, vals in spellings.items()}
+        facets["annee"] = Counter(
+            year_bucket(v["annee"]) for v in voitures if isinstance(v.get("annee"), int)
+        )
+        _facets = facets
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"[rag] facets ready | ms={ms:.1f}")
+    return _facets
+
+def estimate_matches(constraints: Optional[Dict[str, Any]]) -> int:
+    """
+    Estimation instantanée du nombre de voitures correspondant aux contraintes,
+    en supposant les facettes indépendantes. Les bornes prix/km ne sont pas estimées.
+    """
+    facets = get_facet_counts()
+    total = facets["total"]
+    if not constraints or total == 0:
+        return total
+
+    selectivity = 1.0
+    for key in _CATEGORICAL_FACETS:
+        if key in constraints:
+            selectivity *= facets[key].get(str(constraints[key]).lower(), 0) / total
+
+    if "annee_min" in constraints or "annee_max" in constraints:
+        lo = constraints.get("annee_min", -math.inf)
+        hi = constraints.get("annee_max", math.inf)
+        in_range = 0
+        for bucket, count in facets["annee"].items():
+            start, end = (int(x) for x in bucket.split("-"))
+            if end >= lo and start <= hi:
+                in_range += count
+        selectivity *= in_range / total
+
+    return int(math.ceil(total * selectivity))
 
 # ----------------------------
 # Fonction RAG principale
@@ -128,12 +238,16 @@ def _build_where(constraints: Optional[Dict[str, Any]]) -> Optional[Dict[str, An
 
     conditions = []
 
-    if "carburant" in constraints:
-        conditions.append({"carburant": constraints["carburant"]})
-    if "transmission" in constraints:
-        conditions.append({"transmission": constraints["transmission"]})
-    if "marque" in constraints:
-        conditions.append({"marque": constraints["marque"]})
+    # valeurs catégorielles ramenées à l'orthographe du catalogue (Chroma compare à l'exact)
+    valeurs = get_facet_counts()["valeurs"]
+    for key in ("carburant", "transmission", "marque"):
+        if key in constraints:
+            value = str(constraints[key])
+            spellings = valeurs[key].get(value.lower(), [value])
+            if len(spellings) == 1:
+                conditions.append({key: spellings[0]})
+            else:
+                conditions.append({key: {"$in": spellings}})
 
     if "prix_min" in constraints:
         conditions.append({"prix": {"$gte": constraints["prix_min"]}})
@@ -153,18 +267,67 @@ def _build_where(constraints: Optional[Dict[str, Any]]) -> Optional[Dict[str, An
     return {"$and": conditions}
 
 
-def search_voitures(query: str, k: int = 5, constraints: Optional[Dict[str, Any]] = None):
-    embedding_model = _get_embedding_model()
+def _search_group(query_embeddings: list, k: int, constraints: Optional[Dict[str, Any]]) -> list:
+    """
+    Top-k pour plusieurs requêtes partageant les mêmes contraintes, en un seul appel Chroma.
+    Le `where` applique exactement les filtres d'apply_filters: pas de post-filtrage.
+    """
+    if constraints and estimate_matches(constraints) == 0:
+        print(f"[rag] search_filtered | no match in facets, skip query constraints={constraints}")
+        return [[] for _ in query_embeddings]
+
     collection = _get_collection()
-    print(f"[rag] search | k={k} query={query!r}")
-    query_embedding = embedding_model.encode([query], convert_to_numpy=True)[0]
     where = _build_where(constraints)
-    print(f"[rag] where={where}")
-
-    results = collection.query(
-        query_embeddings=[query_embedding.tolist()],
+    print(f"[rag] search_filtered | k={k} queries={len(query_embeddings)} where={where}")
+    response = collection.query(
+        query_embeddings=query_embeddings,
         n_results=k,
         where=where,
     )
+    return response["metadatas"]
+
+
+def search_filtered(query: str, k: int = 5, constraints: Optional[Dict[str, Any]] = None) -> list:
+    """
+    Top-k des voitures respectant les contraintes (k résultats si le catalogue en contient assez).
+    Évite l'appel Chroma quand les facettes montrent qu'aucune voiture ne correspond.
+    """
+    embedding_model = _get_embedding_model()
+    query_embedding = embedding_model.encode([query], convert_to_numpy=True)[0].tolist()
+    return _search_group([query_embedding], k, constraints)[0]
+
+
+def search_filtered_batch(
+    queries: list,
+    constraints_list: list,
+    k: int = 5,
+    batch_size: int = 64,
+) -> list:
+    """
+    Version batch de search_filtered: encode toutes les requêtes d'un coup, puis
+    interroge Chroma une fois par jeu de contraintes distinct.
+    Retourne une liste de résultats alignée sur `queries`.
+    """
+    if not queries:
+        return []
+
+    embedding_model = _get_embedding_model()
+    t0 = time.perf_counter()
+    embeddings = embedding_model.encode(queries, batch_size=batch_size, convert_to_numpy=True)
+    ms = (time.perf_counter() - t0) * 1000
+    print(f"[rag] batch embeddings ready | ms={ms:.1f} count={len(queries)}")
+
+    groups: Dict[str, list] = {}
+    for i, constraints in enumerate(constraints_list):
+        key = json.dumps(constraints or {}, sort_keys=True)
+        groups.setdefault(key, []).append(i)
 
-    return results["metadatas"][0]
+    results: list = [[] for _ in queries]
+    for indices in groups.values():
+        constraints = constraints_list[indices[0]]
+        group_results = _search_group(
+            [embeddings[i].tolist() for i in indices], k, constraints
+        )
+        for i, cars in zip(indices, group_results):
+            results[i] = cars
+    return results
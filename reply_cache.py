@@ -0,0 +1,119 @@
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from rag_engine import embed_texts, get_catalog_signature
+
+# ----------------------------
+# Cache des réponses (tours complets)
+# ----------------------------
+
+# 0 = cache désactivé
+CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "3600"))
+# Similarité cosinus minimale pour réutiliser la réponse d'un message proche (0 = correspondance exacte seulement)
+CACHE_SIMILARITY = float(os.getenv("REPLY_CACHE_SIMILARITY", "0"))
+
+_entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_entries_sig = None
+_lock = threading.Lock()
+
+def normalize_message(text: str) -> str:
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    t = re.sub(r"[^\w\s]", " ", t)
+    return re.sub(r"\s+", " ", t).strip()
+
+def _context_key(intent: str, constraints: Dict[str, Any], car_ids: list) -> tuple:
+    return (intent, json.dumps(constraints, sort_keys=True), tuple(car_ids))
+
+def _check_catalog() -> None:
+    # à appeler sous _lock: vide le cache si voitures.json a changé
+    global _entries_sig
+    current_sig = get_catalog_signature()
+    if _entries_sig != current_sig:
+        if _entries:
+            print("[cache] voitures.json a changé, cache vidé.")
+        _entries.clear()
+        _entries_sig = current_sig
+
+def _purge_expired(now: float) -> None:
+    expired = [key for key, entry in _entries.items() if now - entry["ts"] > CACHE_TTL]
+    for key in expired:
+        del _entries[key]
+
+def get_cached_reply(
+    intent: str,
+    constraints: Dict[str, Any],
+    car_ids: list,
+    message: str,
+) -> Optional[str]:
+    """
+    Réponse déjà générée pour le même contexte (intent, filtres, voitures retenues)
+    et le même message normalisé, ou un message très proche si CACHE_SIMILARITY > 0.
+    """
+    if CACHE_SIZE <= 0:
+        return None
+
+    context = _context_key(intent, constraints, car_ids)
+    normalized = normalize_message(message)
+    key = context + (normalized,)
+    now = time.time()
+
+    with _lock:
+        _check_catalog()
+        _purge_expired(now)
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+            print("[cache] hit (exact)")
+            return entry["reply"]
+        candidates = [
+            (k, e) for k, e in _entries.items()
+            if k[:3] == context and e["embedding"] is not None
+        ]
+
+    if CACHE_SIMILARITY <= 0 or not candidates:
+        return None
+
+    embedding = embed_texts([normalized])[0]
+    best_key, best_score = None, CACHE_SIMILARITY
+    for k, e in candidates:
+        score = float(embedding @ e["embedding"])
+        if score >= best_score:
+            best_key, best_score = k, score
+
+    if best_key is None:
+        return None
+    with _lock:
+        entry = _entries.get(best_key)
+        if entry is None:
+            return None
+        _entries.move_to_end(best_key)
+        print(f"[cache] hit (similarity={best_score:.3f})")
+        return entry["reply"]
+
+def store_reply(
+    intent: str,
+    constraints: Dict[str, Any],
+    car_ids: list,
+    message: str,
+    reply: str,
+) -> None:
+    if CACHE_SIZE <= 0:
+        return
+
+    normalized = normalize_message(message)
+    key = _context_key(intent, constraints, car_ids) + (normalized,)
+    embedding = embed_texts([normalized])[0] if CACHE_SIMILARITY > 0 else None
+
+    with _lock:
+        _check_catalog()
+        _entries[key] = {"reply": reply, "ts": time.time(), "embedding": embedding}
+        _entries.move_to_end(key)
+        while len(_entries) > CACHE_SIZE:
+            _entries.popitem(last=False)
@@ -0,0 +1,152 @@
+import itertools
+import statistics
+import time
+from typing import Any, Dict, Optional
+from filters import apply_filters
+from rag_engine import get_catalog, get_catalog_signature, year_bucket
+
+# ----------------------------
+# Agrégats précalculés du catalogue
+# ----------------------------
+
+# Dimensions d'agrégation; "*" = toutes valeurs confondues
+DIMENSIONS = ("marque", "carburant", "transmission", "annee")
+ALL = "*"
+
+_aggregates = None
+_aggregates_sig = None
+
+def _dimension_value(v: dict, dim: str) -> Optional[str]:
+    if dim == "annee":
+        annee = v.get("annee")
+        return year_bucket(annee) if isinstance(annee, int) else None
+    value = v.get(dim)
+    return str(value).lower() if value is not None else None
+
+def _summary(values: list) -> Dict[str, Any]:
+    if not values:
+        return {"min": None, "median": None, "moyenne": None, "max": None}
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "moyenne": round(statistics.fmean(values)),
+        "max": max(values),
+    }
+
+def _build(voitures: list) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Regroupe les voitures pour chaque combinaison de dimensions, y compris les
+    totaux partiels (ex: ("toyota", "diesel", "*", "*")).
+    """
+    groups: Dict[tuple, Dict[str, list]] = {}
+    masks = list(itertools.product((False, True), repeat=len(DIMENSIONS)))
+    for v in voitures:
+        values = [_dimension_value(v, dim) for dim in DIMENSIONS]
+        prix = v.get("prix")
+        km = v.get("kilometrage_km")
+        for mask in masks:
+            key = tuple(ALL if rolled or val is None else val for rolled, val in zip(mask, values))
+            group = groups.setdefault(key, {"prix": [], "km": [], "count": 0})
+            group["count"] += 1
+            if isinstance(prix, (int, float)):
+                group["prix"].append(prix)
+            if isinstance(km, (int, float)):
+                group["km"].append(km)
+
+    return {
+        key: {
+            "count": group["count"],
+            "prix": _summary(group["prix"]),
+            "kilometrage_km": _summary(group["km"]),
+        }
+        for key, group in groups.items()
+    }
+
+def _get_aggregates() -> Dict[tuple, Dict[str, Any]]:
+    global _aggregates, _aggregates_sig
+    current_sig = get_catalog_signature()
+    if _aggregates is None or _aggregates_sig != current_sig:
+        voitures = get_catalog()
+        print("[stats] building aggregates...")
+        t0 = time.perf_counter()
+        _aggregates = _build(voitures)
+        _aggregates_sig = current_sig
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"[stats] aggregates ready | ms={ms:.1f} groups={len(_aggregates)}")
+    return _aggregates
+
+def warmup() -> None:
+    _get_aggregates()
+
+def get_stats(
+    marque: Optional[str] = None,
+    carburant: Optional[str] = None,
+    transmission: Optional[str] = None,
+    annee: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Statistiques exactes (nombre, prix et km min/médian/moyen/max) pour un groupe.
+    Les dimensions non précisées sont agrégées. `annee` est ramenée à sa tranche.
+    """
+    facets = {
+        "marque": marque.lower() if marque else ALL,
+        "carburant": carburant.lower() if carburant else ALL,
+        "transmission": transmission.lower() if transmission else ALL,
+        "annee": year_bucket(annee) if annee is not None else ALL,
+    }
+    key = tuple(facets[dim] for dim in DIMENSIONS)
+    stats = _get_aggregates().get(key)
+    if stats is None:
+        stats = {"count": 0, "prix": _summary([]), "kilometrage_km": _summary([])}
+    return {"filtres": {k: v for k, v in facets.items() if v != ALL}, **stats}
+
+def _bucket_for_range(annee_min: Optional[int], annee_max: Optional[int]) -> Optional[str]:
+    # tranche précalculée correspondant exactement à [annee_min, annee_max], sinon None
+    if annee_min is None or annee_max is None:
+        return None
+    bucket = year_bucket(annee_min)
+    return bucket if bucket == f"{annee_min}-{annee_max}" else None
+
+def stats_for_constraints(constraints: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Statistiques pour les contraintes extraites par filters.extract_constraints.
+    Lookup dans les agrégats quand les contraintes correspondent à un groupe précalculé;
+    sinon (bornes prix/km, années hors tranche) calcul exact sur les voitures filtrées.
+    `filtres` décrit toujours le périmètre réellement utilisé.
+    """
+    annee_min = constraints.get("annee_min")
+    annee_max = constraints.get("annee_max")
+    has_years = annee_min is not None or annee_max is not None
+    bucket = _bucket_for_range(annee_min, annee_max)
+    has_bounds = any(k in constraints for k in ("prix_min", "prix_max", "km_max"))
+
+    if not has_bounds and (not has_years or bucket is not None):
+        return get_stats(
+            marque=constraints.get("marque"),
+            carburant=constraints.get("carburant"),
+            transmission=constraints.get("transmission"),
+            annee=annee_min if bucket is not None else None,
+        )
+
+    voitures = apply_filters(get_catalog(), constraints)
+    prix = [v["prix"] for v in voitures if isinstance(v.get("prix"), (int, float))]
+    km = [v["kilometrage_km"] for v in voitures if isinstance(v.get("kilometrage_km"), (int, float))]
+    return {
+        "filtres": dict(constraints),
+        "count": len(voitures),
+        "prix": _summary(prix),
+        "kilometrage_km": _summary(km),
+    }
+
+def format_stats(stats: Dict[str, Any]) -> str:
+    filtres = ", ".join(f"{k}={v}" for k, v in stats["filtres"].items()) or "tout le catalogue"
+    if stats["count"] == 0:
+        return f"- périmètre: {filtres}\n- aucune voiture"
+    prix = stats["prix"]
+    km = stats["kilometrage_km"]
+    return (
+        f"- périmètre: {filtres}\n"
+        f"- nombre: {stats['count']} voitures\n"
+        f"- prix (DHS): min {prix['min']} | médian {prix['median']} | moyen {prix['moyenne']} | max {prix['max']}\n"
+        f"- kilométrage (km): min {km['min']} | médian {km['median']} | moyen {km['moyenne']} | max {km['max']}"
+    )